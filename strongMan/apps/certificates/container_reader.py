@@ -1,11 +1,51 @@
-import binascii
 import hashlib
-import re as regex
+import threading
 from collections import OrderedDict
 from enum import Enum
 
-from asn1crypto import keys
-from oscrypto import keys as k
+from asn1crypto import parser, pem
+
+# Offsets of the hex digit pairs of a sha256 digest
+_SHA256_HEX_PAIRS = range(0, 2 * hashlib.sha256().digest_size, 2)
+
+# Raised by oscrypto and asn1crypto if the bytes don't have the expected structure
+_PARSE_ERRORS = (ValueError, TypeError, KeyError, OSError)
+
+_k = None
+
+
+def _oscrypto_keys():
+    '''
+    Imports oscrypto.keys on first use. The import loads the crypto library of the platform,
+    which is not needed until a container gets parsed.
+    :return: the oscrypto.keys module
+    '''
+    global _k
+    if _k is None:
+        from oscrypto import keys
+        _k = keys
+    return _k
+
+
+def _private_key_modulus(private_key_info):
+    return private_key_info["private_key"].parsed["modulus"].native
+
+
+def _private_key_public_key(private_key_info):
+    return private_key_info["private_key"].parsed["public_key"].native
+
+
+def _public_key_modulus(public_key_info):
+    return public_key_info["public_key"].parsed["modulus"].native
+
+
+def _public_key_public_key(public_key_info):
+    return public_key_info["public_key"].native
+
+
+# Functions returning the value the public key hash is made of, by key algorithm
+_PRIVATE_KEY_IDENTS = {"rsa": _private_key_modulus, "ec": _private_key_public_key}
+_PUBLIC_KEY_IDENTS = {"rsa": _public_key_modulus, "ec": _public_key_public_key}
 
 
 class ContainerTypes(Enum):
@@ -21,16 +61,35 @@ class AbstractContainerReader(object):
         self.type = None
         self.password = None
         self.asn1 = None
+        self._loaded = None
+        self._public_key_hash = None
+        self._algorithm = None
         self._is_parsed = False
 
     @classmethod
     def by_bytes(cls, container_bytes, password=None):
+        container_type, loaded = ContainerDetector.detect(container_bytes, password=password)
+        return cls._by_detected(container_bytes, container_type, loaded, password=password)
+
+    @classmethod
+    def _by_detected(cls, container_bytes, container_type, loaded, password=None):
         container = cls()
         container.bytes = container_bytes
-        container.type = ContainerDetector.detect_type(container_bytes, password=password)
+        container.type = container_type
         container.password = password
+        container._loaded = loaded
         return container
 
+    @classmethod
+    def by_parsed(cls, container_type, asn1):
+        '''
+        Creates a reader for an already parsed asn1 structure, e.g. one embedded in another container
+        :param container_type: ContainerTypes of the structure
+        :param asn1: the parsed asn1 structure
+        :return: container reader
+        '''
+        return cls._by_detected(asn1.dump(), container_type, asn1)
+
     def is_parsed(self):
         return self._is_parsed
 
@@ -54,6 +113,15 @@ class AbstractContainerReader(object):
         private key/certificate pair
         :return: Identifier
         '''
+        if self._public_key_hash is None:
+            self._public_key_hash = self._compute_public_key_hash()
+        return self._public_key_hash
+
+    def _compute_public_key_hash(self):
+        '''
+        Computes the public key identifier, gets cached by public_key_hash
+        :return: Identifier
+        '''
         raise NotImplementedError()
 
     @classmethod
@@ -62,133 +130,131 @@ class AbstractContainerReader(object):
         Detects if the bytes have this ASN1 structure
         :return: Boolean
         '''
+        return cls.load(container_bytes, password=password) is not None
+
+    @classmethod
+    def load(cls, container_bytes, password=None):
+        '''
+        Parses the bytes with the asn1 parser of this container type
+        :return: the parsed asn1 structure or None if the bytes don't have this ASN1 structure
+        '''
         raise NotImplementedError()
 
-    def _sha256(self, value):
+    def _loaded_asn1(self):
+        '''
+        Returns the asn1 structure already parsed by the type detection, parses the bytes otherwise
+        '''
+        if self._loaded is None:
+            self._loaded = self.load(self.bytes, password=self.password)
+        return self._loaded
+
+    def _sha256(self, ident):
         '''
-        Makes a sha256 hash over a string value. Formats the hash to be readable
-        :param value: input
+        Makes a sha256 hash over the string representation of a public key value.
+        Formats the hash to be readable
+        The representation is part of the identifiers stored in the database and therefore must not change
+        :param ident: modulus (int) or public key (bytes)
         :return: formated hash
         '''
-        value = value.encode('utf-8')
-        sha = hashlib.sha256()
-        sha.update(value)
-        hash_bytes = sha.digest()
+        hash_bytes = hashlib.sha256(str(ident).encode('utf-8')).digest()
         return self._format_hash(hash_bytes)
 
     def _format_hash(self, hash_bytes):
-        hash_hex = binascii.hexlify(hash_bytes)
-        hash_upper = hash_hex.decode('utf-8').upper()
-        formated_hash = ""
-        for part in regex.findall('..', hash_upper):
-            formated_hash += part + ":"
-
-        return formated_hash[:-1]
+        '''
+        Formats a sha256 digest as colon separated pairs of uppercase hex digits
+        '''
+        hash_upper = hash_bytes.hex().upper()
+        return ":".join([hash_upper[i:i + 2] for i in _SHA256_HEX_PAIRS])
 
     def _raise_if_wrong_algorithm(self):
-        algorithm_lower = self.algorithm().lower()
-        wrong_algorihm = not (algorithm_lower == "rsa" or algorithm_lower == "ec")
-        if wrong_algorihm:
-            raise Exception("Detected unsupported algorithm " + str(algorithm_lower))
+        algorithm = self.algorithm()
+        if algorithm not in ("rsa", "ec"):
+            raise Exception("Detected unsupported algorithm " + str(algorithm))
 
     def algorithm(self):
         '''
         :return: "rsa" or "ec"
         '''
+        if self._algorithm is None:
+            self._algorithm = self._read_algorithm().lower()
+        return self._algorithm
+
+    def _read_algorithm(self):
+        '''
+        Reads the key algorithm from the asn1 structure, gets cached by algorithm
+        :return: name of the algorithm
+        '''
         raise NotImplementedError()
 
 
 class PrivateReader(AbstractContainerReader):
     @classmethod
-    def is_type(cls, container_bytes, password=None):
-        cert = None
+    def load(cls, container_bytes, password=None):
+        k = _oscrypto_keys()
         try:
             if password is None:
                 cert = k.parse_private(container_bytes)
             else:
                 cert = k.parse_private(container_bytes, password=password)
 
-            cert.native
-        except Exception:
-            return False
-
-        try:
-            if cert.native["private_key"]["modulus"] is not None:
-                return True
-        except:
-            pass
-
-        try:
-            if cert.native["private_key"]["public_key"] is not None:
-                return True
-        except:
-            pass
+            private_key = cert.native["private_key"]
+        except _PARSE_ERRORS:
+            return None
 
-        return False
+        if not isinstance(private_key, dict):
+            return None
+        if private_key.get("modulus") is not None or private_key.get("public_key") is not None:
+            return cert
+        return None
 
     def parse(self):
         assert self.type == ContainerTypes.Private
-        if self.password is None:
-            self.asn1 = k.parse_private(self.bytes)
-        else:
-            self.asn1 = k.parse_private(self.bytes, password=self.password)
-        self.asn1.native
+        self.asn1 = self._loaded_asn1()
         self._raise_if_wrong_algorithm()
         self._is_parsed = True
 
     def der_dump(self):
         return self.asn1.dump()
 
-    def public_key_hash(self):
-        if self.algorithm() == "rsa":
-            ident = self.asn1.native["private_key"]["modulus"]
-        elif self.algorithm() == "ec":
-            ident = self.asn1.native["private_key"]["public_key"]
-
-        return self._sha256(str(ident))
+    def _compute_public_key_hash(self):
+        ident = _PRIVATE_KEY_IDENTS[self.algorithm()](self.asn1)
+        return self._sha256(ident)
 
-    def algorithm(self):
+    def _read_algorithm(self):
         return self.asn1.algorithm
 
 
 class PKCS12Reader(AbstractContainerReader):
     @classmethod
-    def is_type(cls, container_bytes, password=None):
+    def load(cls, container_bytes, password=None):
+        k = _oscrypto_keys()
         try:
             if password is None:
-                k.parse_pkcs12(container_bytes)
+                return k.parse_pkcs12(container_bytes)
             else:
-                k.parse_pkcs12(container_bytes, password=password)
-            return True
-        except Exception:
-            return False
+                return k.parse_pkcs12(container_bytes, password=password)
+        except _PARSE_ERRORS:
+            return None
 
     def parse(self):
         assert self.type == ContainerTypes.PKCS12
-        if self.password is None:
-            (self.privatekey, self.cert, self.certs) = k.parse_pkcs12(self.bytes)
-        else:
-            (self.privatekey, self.cert, self.certs) = k.parse_pkcs12(self.bytes, password=self.password)
+        (self.privatekey, self.cert, self.certs) = self._loaded_asn1()
         self._raise_if_wrong_algorithm()
         self._is_parsed = True
 
-    def algorithm(self):
+    def _read_algorithm(self):
         return self.privatekey.algorithm
 
-    def public_key_hash(self):
-        if self.algorithm() == "rsa":
-            ident = self.privatekey.native["private_key"]["modulus"]
-        elif self.algorithm() == "ec":
-            ident = self.privatekey.native["private_key"]["public_key"]
-        return self._sha256(str(ident))
+    def _compute_public_key_hash(self):
+        ident = _PRIVATE_KEY_IDENTS[self.algorithm()](self.privatekey)
+        return self._sha256(ident)
 
     def public_key(self):
         '''
         :return: the main X509 cert in this container
         :rtype X509Container
         '''
-        data = self.cert.dump()
-        container = X509Reader.by_bytes(data)
+        container = X509Reader.by_parsed(ContainerTypes.X509, self.cert)
         container.parse()
         return container
 
@@ -197,8 +263,7 @@ class PKCS12Reader(AbstractContainerReader):
         :return: The private key in this container
         :rtype PrivateContainer
         '''
-        data = self.privatekey.dump()
-        container = PrivateReader.by_bytes(data)
+        container = PrivateReader.by_parsed(ContainerTypes.Private, self.privatekey)
         container.parse()
         return container
 
@@ -209,8 +274,7 @@ class PKCS12Reader(AbstractContainerReader):
         '''
         others = []
         for cer in self.certs:
-            data = cer.dump()
-            x509 = X509Reader.by_bytes(data)
+            x509 = X509Reader.by_parsed(ContainerTypes.X509, cer)
             x509.parse()
             others.append(x509)
         return others
@@ -218,33 +282,30 @@ class PKCS12Reader(AbstractContainerReader):
 
 class X509Reader(AbstractContainerReader):
     @classmethod
-    def is_type(cls, container_bytes, password=None):
+    def load(cls, container_bytes, password=None):
+        k = _oscrypto_keys()
         try:
             cert = k.parse_certificate(container_bytes)
             cert.native
-            return True
-        except Exception:
-            return False
+            return cert
+        except _PARSE_ERRORS:
+            return None
 
     def parse(self):
         assert self.type == ContainerTypes.X509
-        self.asn1 = k.parse_certificate(self.bytes)
-        self.asn1.native
+        self.asn1 = self._loaded_asn1()
         self._raise_if_wrong_algorithm()
         self._is_parsed = True
 
     def der_dump(self):
         return self.asn1.dump()
 
-    def algorithm(self):
-        return self.asn1.native["tbs_certificate"]["subject_public_key_info"]["algorithm"]["algorithm"]
+    def _read_algorithm(self):
+        return self.asn1.public_key["algorithm"]["algorithm"].native
 
-    def public_key_hash(self):
-        if self.algorithm() == "rsa":
-            ident = self.asn1.native["tbs_certificate"]["subject_public_key_info"]["public_key"]["modulus"]
-        elif self.algorithm() == "ec":
-            ident = self.asn1.native["tbs_certificate"]["subject_public_key_info"]["public_key"]
-        return self._sha256(str(ident))
+    def _compute_public_key_hash(self):
+        ident = _PUBLIC_KEY_IDENTS[self.algorithm()](self.asn1.public_key)
+        return self._sha256(ident)
 
     def is_cert_of(self, container):
         '''
@@ -275,6 +336,124 @@ class ContainerDetector(object):
         (ContainerTypes.Private, PrivateReader),
     ])
 
+    _pem_types = {
+        b"CERTIFICATE": ContainerTypes.X509,
+        b"X509 CERTIFICATE": ContainerTypes.X509,
+        b"RSA PRIVATE KEY": ContainerTypes.Private,
+        b"EC PRIVATE KEY": ContainerTypes.Private,
+        b"DSA PRIVATE KEY": ContainerTypes.Private,
+        b"PRIVATE KEY": ContainerTypes.Private,
+        b"ENCRYPTED PRIVATE KEY": ContainerTypes.Private,
+    }
+
+    _type_cache = OrderedDict()
+    _type_cache_size = 128
+    _type_cache_lock = threading.Lock()
+
+    @classmethod
+    def _fast_detect(cls, container_bytes):
+        '''
+        Guesses the type of an ASN.1 container by its PEM armor or the first element of its DER structure
+        without decoding the whole container
+        :param container_bytes: bytes of the container in PEM or DER
+        :return: The likely type of the container, ContainerTypes.Undefined if no guess is possible
+        :rtype ContainerTypes
+        '''
+        begin = container_bytes.find(b"-----BEGIN ")
+        if begin != -1:
+            while begin != -1:
+                start = begin + len(b"-----BEGIN ")
+                end = container_bytes.find(b"-----", start)
+                label = container_bytes[start:end]
+                if label in cls._pem_types:
+                    return cls._pem_types[label]
+                begin = container_bytes.find(b"-----BEGIN ", start)  # e.g. after EC PARAMETERS
+            return ContainerTypes.Undefined
+
+        try:
+            class_, _, tag, _, content, _ = parser.parse(container_bytes)
+            if class_ != 0 or tag != 16:
+                return ContainerTypes.Undefined
+            _, _, first_tag, _, first_content, _ = parser.parse(content)
+            if first_tag == 16:
+                # tbsCertificate of a certificate or the algorithm of an encrypted private key
+                _, _, nested_tag, _, _, _ = parser.parse(first_content)
+        except ValueError:
+            return ContainerTypes.Undefined
+
+        if first_tag == 16:
+            return ContainerTypes.Private if nested_tag == 6 else ContainerTypes.X509
+        if first_tag == 2 and first_content == b"\x03":
+            return ContainerTypes.PKCS12  # PFX starts with version 3
+        return ContainerTypes.Private
+
+    @classmethod
+    def detect(cls, container_bytes, password=None):
+        '''
+        Detects the type of an ASN.1 container. Every reader parses the bytes at most once,
+        starting with the reader of the type detected for the same container before or
+        of the type guessed by _fast_detect.
+        :param container_bytes: bytes of the container in PEM or DER
+        :param password: password of the container if encrypted
+        :return: Type of the container and the parsed asn1 structure (None if the type is undefined)
+        :rtype (ContainerTypes, object)
+        '''
+        cache_key = cls._type_cache_key(container_bytes, password)
+        likely_type = cls._cached_type(cache_key)
+        if likely_type == ContainerTypes.Undefined:
+            return ContainerTypes.Undefined, None
+        der_bytes = cls._unarmor(container_bytes)
+        if likely_type is None:
+            likely_type = cls._fast_detect(der_bytes)
+
+        readers = sorted(cls._readers.items(), key=lambda item: item[0] != likely_type)
+        for ct, reader in readers:
+            loaded = reader.load(der_bytes, password=password)
+            if loaded is not None:
+                cls._cache_type(cache_key, ct)
+                return ct, loaded
+        cls._cache_type(cache_key, ContainerTypes.Undefined)
+        return ContainerTypes.Undefined, None
+
+    @classmethod
+    def _unarmor(cls, container_bytes):
+        '''
+        Decodes a PEM container once instead of letting every reader decode it again
+        :param container_bytes: bytes of the container in PEM or DER
+        :return: the DER bytes, or the unchanged bytes if they are DER or an encrypted PEM key
+        '''
+        if not pem.detect(container_bytes):
+            return container_bytes
+        try:
+            _, headers, der_bytes = pem.unarmor(container_bytes)
+        except ValueError:
+            return container_bytes
+        if headers:
+            return container_bytes  # The encryption of OpenSSL's PEM keys is described in the headers
+        return der_bytes
+
+    @classmethod
+    def _type_cache_key(cls, container_bytes, password):
+        # Only digests are kept, the cache must not hold containers or passwords in memory
+        password_digest = None if password is None else hashlib.sha256(password).digest()
+        return hashlib.sha256(container_bytes).digest(), password_digest
+
+    @classmethod
+    def _cached_type(cls, cache_key):
+        with cls._type_cache_lock:
+            container_type = cls._type_cache.get(cache_key)
+            if container_type is not None:
+                cls._type_cache.move_to_end(cache_key)
+            return container_type
+
+    @classmethod
+    def _cache_type(cls, cache_key, container_type):
+        with cls._type_cache_lock:
+            cls._type_cache[cache_key] = container_type
+            cls._type_cache.move_to_end(cache_key)
+            if len(cls._type_cache) > cls._type_cache_size:
+                cls._type_cache.popitem(last=False)
+
     @classmethod
     def detect_type(cls, container_bytes, password=None):
         '''
@@ -284,10 +463,7 @@ class ContainerDetector(object):
         :return: Type of the container
         :rtype ContainerTypes
         '''
-        for ct, reader in cls._readers.items():
-            if reader.is_type(container_bytes, password=password):
-                return ct
-        return ContainerTypes.Undefined
+        return cls.detect(container_bytes, password=password)[0]
 
     @classmethod
     def factory(cls, container_bytes, password=None):
@@ -298,7 +474,8 @@ class ContainerDetector(object):
         :return: container reader
         :rtype object derived of AbstractContainerReader
         '''
-        reader = cls._readers[cls.detect_type(container_bytes, password)]
+        container_type, loaded = cls.detect(container_bytes, password)
+        reader = cls._readers.get(container_type)
         if reader:
-            return reader.by_bytes(container_bytes, password)
+            return reader._by_detected(container_bytes, container_type, loaded, password=password)
         raise ContainerReaderException("Can't detect a supported ASN.1 type.")
@@ -194,27 +194,16 @@ class CertificateFactory(object):
 
         subject = DistinguishedName()
         subject.blob = asn1_object.contents
-        subject.location = cls._try_to_get_value(dic, ["locality_name"], default="")
-        subject.cname = cls._try_to_get_value(dic, ["common_name"], default="")
-        subject.country = cls._try_to_get_value(dic, ["country_name"], default="")
-        subject.email = cls._try_to_get_value(dic, ["email_address"], default="")
-        subject.organization = cls._try_to_get_value(dic, ["organization_name"], default="")
-        subject.unit = cls._try_to_get_value(dic, ["organizational_unit_name"], default="")
-        subject.province = cls._try_to_get_value(dic, ["state_or_province_name"], default="")
+        subject.location = dic.get("locality_name", "")
+        subject.cname = dic.get("common_name", "")
+        subject.country = dic.get("country_name", "")
+        subject.email = dic.get("email_address", "")
+        subject.organization = dic.get("organization_name", "")
+        subject.unit = dic.get("organizational_unit_name", "")
+        subject.province = dic.get("state_or_province_name", "")
         subject.save()
         return subject
 
-    @classmethod
-    def _try_to_get_value(cls, dic, key_path, default=None):
-        try:
-            temp_dic = dic
-            for key in key_path:
-                temp_dic = temp_dic[key]
-
-            return temp_dic
-        except:
-            return default
-
     @classmethod
     def _by_X509Container(cls, reader, certificate_class=UserCertificate):
         public = certificate_class()
@@ -229,10 +218,9 @@ class CertificateFactory(object):
                 public.is_CA = False
             else:
                 public.is_CA = True
-            public.valid_not_after = cls._try_to_get_value(reader.asn1.native,
-                                                           ["tbs_certificate", "validity", "not_after"])
-            public.valid_not_before = cls._try_to_get_value(reader.asn1.native,
-                                                            ["tbs_certificate", "validity", "not_before"])
+            validity = reader.asn1["tbs_certificate"]["validity"]
+            public.valid_not_after = validity["not_after"].native
+            public.valid_not_before = validity["not_before"].native
             public.save()
             public.issuer = cls.distinguishedName_factory(reader.asn1.issuer)
             public.subject = cls.distinguishedName_factory(reader.asn1.subject)
@@ -55,6 +55,50 @@ class ContainerDetectorTest(TestCase):
     def test_pkcs12_type_encrypted_without_pw(self):
         self.assertEqual(self.get_type(TestCertificates.PKCS12_rsa_encrypted, None), None)
 
+    def test_fast_detect(self):
+        self.assertEqual(ContainerDetector._fast_detect(TestCertificates.X509_rsa_ca.read()), ContainerTypes.X509)
+        self.assertEqual(ContainerDetector._fast_detect(TestCertificates.X509_rsa_ca_der.read()),
+                         ContainerTypes.X509)
+        self.assertEqual(ContainerDetector._fast_detect(TestCertificates.PKCS1_rsa_ca.read()),
+                         ContainerTypes.Private)
+        self.assertEqual(ContainerDetector._fast_detect(TestCertificates.PKCS8_rsa_ca_encrypted.read()),
+                         ContainerTypes.Private)
+        self.assertEqual(ContainerDetector._fast_detect(TestCertificates.PKCS12_rsa.read()), ContainerTypes.PKCS12)
+        self.assertEqual(ContainerDetector._fast_detect(b"no container"), ContainerTypes.Undefined)
+
+    def test_detect_returns_parsed_structure(self):
+        bytes = TestCertificates.X509_rsa_ca.read()
+        container_type, loaded = ContainerDetector.detect(bytes)
+        self.assertEqual(container_type, ContainerTypes.X509)
+        self.assertIsNotNone(loaded)
+
+    def test_detect_undefined(self):
+        container_type, loaded = ContainerDetector.detect(b"no container")
+        self.assertEqual(container_type, ContainerTypes.Undefined)
+        self.assertIsNone(loaded)
+
+    def test_detect_cached_type(self):
+        bytes = TestCertificates.PKCS12_rsa_encrypted.read()
+        self.assertEqual(ContainerDetector.detect_type(bytes, password=b"strongman"), ContainerTypes.PKCS12)
+        self.assertEqual(ContainerDetector.detect_type(bytes, password=b"strongman"), ContainerTypes.PKCS12)
+        self.assertEqual(ContainerDetector.detect_type(bytes), ContainerTypes.Undefined)
+        self.assertEqual(ContainerDetector.detect_type(bytes), ContainerTypes.Undefined)
+        container_type, loaded = ContainerDetector.detect(bytes, password=b"strongman")
+        self.assertEqual(container_type, ContainerTypes.PKCS12)
+        self.assertIsNotNone(loaded)
+
+    def test_detect_cache_size(self):
+        for i in range(ContainerDetector._type_cache_size + 10):
+            ContainerDetector.detect_type(str(i).encode())
+        self.assertEqual(len(ContainerDetector._type_cache), ContainerDetector._type_cache_size)
+
+    def test_factory_reuses_detected_structure(self):
+        bytes = TestCertificates.PKCS1_rsa_ca.read()
+        container = ContainerDetector.factory(bytes)
+        self.assertIsInstance(container, PrivateReader)
+        container.parse()
+        self.assertIs(container.asn1, container._loaded)
+
 
 class AbstractContainerTest(TestCase):
     def create_test_container(self, testcert):
@@ -238,6 +282,13 @@ class PCKS12ContainerTest(TestCase):
         key = containe.private_key()
         self.assertIsInstance(key, container_reader.PrivateReader)
 
+    def test_embedded_structures_not_reparsed(self):
+        bytes = TestCertificates.PKCS12_rsa.read()
+        container = PKCS12Reader.by_bytes(bytes)
+        container.parse()
+        self.assertIs(container.public_key().asn1, container.cert)
+        self.assertIs(container.private_key().asn1, container.privatekey)
+
     def test_other_x509(self):
         bytes = TestCertificates.PKCS12_rsa.read()
         container = PKCS12Reader.by_bytes(bytes)
@@ -313,6 +364,12 @@ class X509ContainerTest(TestCase):
         key.parse()
         self.assertTrue(x509.is_cert_of(key))
 
+    def test_identifier_cached(self):
+        bytes = TestCertificates.X509_rsa_ca.read()
+        container = X509Reader.by_bytes(bytes)
+        container.parse()
+        self.assertIs(container.public_key_hash(), container.public_key_hash())
+
     def test_is_private_key_not(self):
         bytes = TestCertificates.X509_ec.read()
         x509 = X509Reader.by_bytes(bytes)